@@ -0,0 +1,189 @@
+import os
+import asyncio
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from jinja2 import Environment
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, FileResponse
+from starlette.routing import Route, Mount
+from starlette.staticfiles import StaticFiles
+from werkzeug.utils import safe_join, secure_filename
+from inference import (
+    MAX_UPLOAD_MB, UPLOAD_FOLDER, RESULT_FOLDER, MAX_CONCURRENT_INFERENCE, MAX_INFERENCE_QUEUE,
+    InvalidUpload, InferenceShed, validate_image, check_rate_limit, admission_snapshot, admit,
+    run_detection,
+)
+from templates import index_html, result_html
+
+# ASGI variant of app.py: same routes and inference core, but uploads are received
+# on the event loop and inference runs on a dedicated thread pool, so slow clients
+# only cost a coroutine instead of a worker thread.
+# Run with: uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+
+MAX_CONTENT_LENGTH = int(MAX_UPLOAD_MB * 1024 * 1024)
+# Set to 1 only when a proxy (e.g. Render's) sits in front and appends the
+# client address to X-Forwarded-For; otherwise clients could pick their own
+# rate-limit key by sending the header themselves.
+TRUST_PROXY = os.environ.get('TRUST_PROXY', '0') == '1'
+
+# One thread per inference slot plus one per queued request. Requests are only
+# submitted after admit() has reserved them a place, and run_detection holds its
+# reservation until the job is done, so a reserved job only waits in the pool's
+# own queue for the moment a finishing thread takes to return.
+inference_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_INFERENCE + MAX_INFERENCE_QUEUE, thread_name_prefix='inference')
+
+
+def url_for(endpoint, **values):
+    # Flask-style url_for so the templates can be shared with app.py.
+    if endpoint == 'static':
+        return f"/static/{values['filename']}"
+    return app.url_path_for(endpoint, **values)
+
+jinja_env = Environment(autoescape=True)
+jinja_env.globals['url_for'] = url_for
+index_template = jinja_env.from_string(index_html)
+result_template = jinja_env.from_string(result_html)
+
+
+def client_id(request):
+    # Behind a trusted proxy, use only the right-most X-Forwarded-For hop,
+    # which that proxy appends; entries to its left come from the client.
+    forwarded = request.headers.get('x-forwarded-for')
+    if TRUST_PROXY and forwarded:
+        return forwarded.split(',')[-1].strip()
+    return request.client.host if request.client else None
+
+
+class BodySizeLimit:
+    """Reject request bodies over max_bytes, from Content-Length and while streaming."""
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_bytes:
+                return await too_large_response()(scope, receive, send)
+        received = 0
+
+        async def limited_receive():
+            # Count bytes as they stream in so a missing or lying header can't
+            # push the body past the limit. Raised inside the route's form
+            # parsing, so the HTTPException handler turns it into a 413.
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    raise HTTPException(413)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def save_upload(upload, upload_path):
+    upload.file.seek(0)
+    with open(upload_path, 'wb') as out:
+        shutil.copyfileobj(upload.file, out)
+
+
+def too_large_response():
+    return PlainTextResponse(f'File too large, the limit is {MAX_UPLOAD_MB:g} MB', 413)
+
+
+def overloaded_response(shed):
+    message = 'Too many requests' if shed.status == 429 else 'Server busy, please retry shortly'
+    return PlainTextResponse(message, shed.status, headers={'Retry-After': str(shed.retry_after)})
+
+
+async def index(request):
+    if request.method == 'POST':
+        form = await request.form()
+        # Check for file in request
+        file = form.get('file')
+        if file is None or isinstance(file, str) or file.filename == '':
+            return RedirectResponse(str(request.url), status_code=302)
+        try:
+            check_rate_limit(client_id(request))
+        except InferenceShed as shed:
+            return overloaded_response(shed)
+
+        try:
+            # Header parsing may hit disk once the upload has spooled over.
+            await run_in_threadpool(validate_image, file.file)
+        except InvalidUpload as err:
+            return PlainTextResponse(str(err), err.status)
+
+        # Save the uploaded file, under a name that can't leave the folder
+        filename = secure_filename(file.filename)
+        if not filename:
+            return PlainTextResponse('Invalid file name', 400)
+        upload_path = os.path.join(UPLOAD_FOLDER, filename)
+        await run_in_threadpool(save_upload, file, upload_path)
+        await file.close()
+
+        # Define the output path (static/results folder with same filename)
+        output_path = os.path.join(RESULT_FOLDER, filename)
+        # Decide admission here on the event loop, so only admitted work
+        # reaches the inference pool, then wait there for a free slot
+        try:
+            deadline = admit()
+            loop = asyncio.get_running_loop()
+            detection = loop.run_in_executor(
+                inference_executor, run_detection, upload_path, output_path, deadline)
+            # Shielded so a cancelled request can't drop the job from the pool's
+            # queue before run_detection releases its reservation.
+            await asyncio.shield(detection)
+        except InferenceShed as shed:
+            return overloaded_response(shed)
+
+        # Redirect to the result page
+        return RedirectResponse(app.url_path_for('result', filename=filename), status_code=302)
+    return HTMLResponse(index_template.render())
+
+
+async def http_error(request, exc):
+    if exc.status_code == 413:
+        return too_large_response()
+    return PlainTextResponse(exc.detail, exc.status_code)
+
+
+async def stats(request):
+    return JSONResponse(admission_snapshot())
+
+
+async def result(request):
+    return HTMLResponse(result_template.render(filename=request.path_params['filename']))
+
+
+async def uploaded_file(request):
+    path = safe_join(UPLOAD_FOLDER, request.path_params['filename'])
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(404)
+    return FileResponse(path)
+
+
+app = Starlette(
+    routes=[
+        Route('/', index, methods=['GET', 'POST'], name='index'),
+        Route('/stats', stats, name='stats'),
+        Route('/result/{filename}', result, name='result'),
+        Route('/uploads/{filename}', uploaded_file, name='uploaded_file'),
+        Mount('/static', StaticFiles(directory='static'), name='static'),
+    ],
+    middleware=[Middleware(BodySizeLimit, max_bytes=MAX_CONTENT_LENGTH)],
+    exception_handlers={HTTPException: http_error},
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 8000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
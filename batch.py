@@ -0,0 +1,351 @@
+"""Offline batch detection over a directory or manifest of scans.
+
+Uses the same model loading and predict/plot code as the web app (inference.py).
+Work is split into chunks across worker processes. Each worker decodes the next
+batch on a background thread while the current one is on the model. Detections
+are written as one row per box (CSV, JSONL or Parquet). Every finished chunk is
+recorded in a checkpoint file together with the output position after its rows,
+so an interrupted run cuts the output back to that point and picks up where it
+left off.
+
+    python batch.py /data/scans --output detections.csv --workers 4 --overlay-dir overlays
+    python batch.py manifest.txt --output detections.parquet   # resumes if re-run
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp'}
+COLUMNS = ['path', 'num_detections', 'class_id', 'class_name', 'confidence',
+           'x1', 'y1', 'x2', 'y2', 'image_width', 'image_height', 'error']
+
+# Set in each worker process by init_worker.
+inference = None
+cv2 = None
+worker_args = None
+
+
+def find_images(source):
+    """Yield image paths from a directory tree, or from a manifest file.
+
+    A manifest is either a CSV with a 'path' column or a text file with one
+    path per line; relative paths are resolved against the manifest's folder.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield os.path.join(root, name)
+        return
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='') as f:
+        if source.lower().endswith('.csv'):
+            paths = (row['path'] for row in csv.DictReader(f))
+        else:
+            paths = (line.strip() for line in f)
+        for path in paths:
+            if path and not path.startswith('#'):
+                yield path if os.path.isabs(path) else os.path.join(base, path)
+
+
+def load_checkpoint(path):
+    """Return (finished paths, output position, bytes of valid checkpoint).
+
+    Each line is a JSON record for one chunk: its paths and the output position
+    (byte offset, or Parquet part count) after its rows were written. A last
+    line cut short by a crash is ignored.
+    """
+    done, position, valid = set(), 0, 0
+    if not os.path.exists(path):
+        return done, position, valid
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            done.update(record['paths'])
+            position = record['position']
+            valid += len(line)
+    return done, position, valid
+
+
+class DetectionWriter:
+    """Append detection rows to a CSV, JSONL or Parquet output.
+
+    Anything past position (as recorded in the checkpoint) is left over from
+    an interrupted run, either a half-written row or rows whose chunk never
+    reached the checkpoint, and is dropped before writing resumes.
+    """
+
+    def __init__(self, path, fmt, position=0):
+        self.path = path
+        self.fmt = fmt
+        if fmt == 'parquet':
+            # Parquet files can't be appended to, so each flush (and each
+            # resumed run) adds a new part file under the output directory.
+            import pyarrow
+            import pyarrow.parquet
+            self.pyarrow = pyarrow
+            self.pyarrow_parquet = pyarrow.parquet
+            # Fixed schema, so parts with only empty rows still line up.
+            self.schema = pyarrow.schema([
+                ('path', pyarrow.string()), ('num_detections', pyarrow.int32()),
+                ('class_id', pyarrow.int32()), ('class_name', pyarrow.string()),
+                ('confidence', pyarrow.float32()),
+                ('x1', pyarrow.float32()), ('y1', pyarrow.float32()),
+                ('x2', pyarrow.float32()), ('y2', pyarrow.float32()),
+                ('image_width', pyarrow.int32()), ('image_height', pyarrow.int32()),
+                ('error', pyarrow.string()),
+            ])
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.endswith('.tmp') or (name.startswith('part-') and name.endswith('.parquet')
+                                             and int(name[5:-8]) >= position):
+                    os.remove(os.path.join(path, name))
+            self.part = position
+            self.file = None
+            return
+        if os.path.exists(path):
+            os.truncate(path, position)
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(self.file, fieldnames=COLUMNS)
+            if position == 0:
+                self.csv.writeheader()
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.fmt == 'parquet':
+            table = self.pyarrow.Table.from_pylist(rows, schema=self.schema)
+            part_path = os.path.join(self.path, f'part-{self.part:05d}.parquet')
+            # Write to a temp file, fsync and rename, so a part is on disk in
+            # full before its paths go into the checkpoint.
+            tmp_path = part_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                self.pyarrow_parquet.write_table(table, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, part_path)
+            dir_fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            self.part += 1
+            return
+        if self.fmt == 'csv':
+            self.csv.writerows(rows)
+        else:
+            for row in rows:
+                self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def position(self):
+        """Where the output ends now: a byte offset, or the Parquet part count."""
+        if self.fmt == 'parquet':
+            return self.part
+        self.file.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def init_worker(args, startup_lock):
+    global inference, cv2, worker_args
+    # Importing inference loads the model (and its tuned ONNX session) once per
+    # process; it also sets the OpenCV pixel cap, so cv2 is imported after it.
+    # Workers start one at a time so only the first downloads a missing model.
+    with startup_lock:
+        import inference as inference_module
+    import cv2 as cv2_module
+    cv2_module.setNumThreads(1)
+    inference = inference_module
+    cv2 = cv2_module
+    worker_args = args
+
+
+def decode(path):
+    try:
+        return cv2.imread(path), None
+    except Exception as err:
+        return None, str(err)
+
+
+def decode_batch(paths, decoder):
+    return list(zip(paths, decoder.map(decode, paths)))
+
+
+def detection_rows(path, result):
+    height, width = result.orig_shape
+    boxes = result.boxes
+    base = {'path': path, 'num_detections': len(boxes), 'image_width': width,
+            'image_height': height, 'error': None}
+    if len(boxes) == 0:
+        # Keep a row for clean scans so they're distinguishable from skipped ones.
+        return [dict(base, class_id=None, class_name=None, confidence=None,
+                     x1=None, y1=None, x2=None, y2=None)]
+    rows = []
+    for (x1, y1, x2, y2), conf, cls in zip(boxes.xyxy.tolist(), boxes.conf.tolist(),
+                                           boxes.cls.tolist()):
+        rows.append(dict(base, class_id=int(cls), class_name=result.names[int(cls)],
+                         confidence=round(conf, 5), x1=round(x1, 2), y1=round(y1, 2),
+                         x2=round(x2, 2), y2=round(y2, 2)))
+    return rows
+
+
+def error_row(path, error):
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, num_detections=0, error=error)
+    return row
+
+
+def overlay_path(path):
+    relative = os.path.relpath(os.path.abspath(path), worker_args.root)
+    if relative.startswith('..'):
+        relative = os.path.abspath(path).lstrip(os.sep)
+    return os.path.join(worker_args.overlay_dir, relative)
+
+
+def process_chunk(paths):
+    """Run detection over one chunk of paths; returns (rows, finished paths)."""
+    limit = inference.batch_limit()
+    # A graph with a fixed batch size takes exactly that many images per call.
+    batch_size = limit or worker_args.batch_size
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    rows = []
+    with ThreadPoolExecutor(max_workers=1) as prefetch, \
+            ThreadPoolExecutor(max_workers=worker_args.decode_threads) as decoder:
+        # Decode the next batch in the background while the model runs.
+        pending = prefetch.submit(decode_batch, batches[0], decoder) if batches else None
+        for i in range(len(batches)):
+            decoded = pending.result()
+            if i + 1 < len(batches):
+                pending = prefetch.submit(decode_batch, batches[i + 1], decoder)
+            images, image_paths = [], []
+            for path, (image, error) in decoded:
+                if image is None:
+                    rows.append(error_row(path, error or 'could not decode image'))
+                else:
+                    images.append(image)
+                    image_paths.append(path)
+            if not images:
+                continue
+            try:
+                rows.extend(detect_batch(image_paths, images, limit))
+            except Exception:
+                # Retry one image at a time so a single bad scan is recorded
+                # as an error instead of failing the chunk on every re-run.
+                for path, image in zip(image_paths, images):
+                    try:
+                        rows.extend(detect_batch([path], [image], limit))
+                    except Exception as err:
+                        rows.append(error_row(path, f'{type(err).__name__}: {err}'))
+    return rows, paths
+
+
+def detect_batch(paths, images, limit):
+    count = len(images)
+    if limit and count < limit:
+        # A static graph rejects short batches (the last one in a chunk, or
+        # one that lost images to decode errors), so pad with copies of the
+        # last image and drop their results.
+        images = images + [images[-1]] * (limit - count)
+    results = inference.predict(images, verbose=False)[:count]
+    rows = []
+    for path, result in zip(paths, results):
+        rows.extend(detection_rows(path, result))
+        if worker_args.overlay_dir:
+            out_path = overlay_path(path)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            cv2.imwrite(out_path, result.plot())
+    return rows
+
+
+def output_format(path, fmt):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl', '.parquet': 'parquet'}.get(ext, 'csv')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run tumor detection over a directory or manifest of scans.')
+    parser.add_argument('source', help='directory to walk, or a manifest (.csv with a path column, or one path per line)')
+    parser.add_argument('--output', required=True, help='detections file (.csv, .jsonl) or Parquet directory (.parquet)')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'], help='output format (default: from --output)')
+    parser.add_argument('--checkpoint', help='file of finished paths (default: <output>.checkpoint)')
+    parser.add_argument('--overlay-dir', help='also write annotated images here, mirroring the source layout')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='inference processes')
+    parser.add_argument('--batch-size', type=int, default=8, help='images per model call')
+    parser.add_argument('--chunk-size', type=int, default=64, help='images per checkpointed unit of work')
+    parser.add_argument('--decode-threads', type=int, default=2, help='image decode threads per worker')
+    args = parser.parse_args(argv)
+
+    fmt = output_format(args.output, args.format)
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('Parquet output needs pyarrow: pip install pyarrow')
+    checkpoint_path = args.checkpoint or args.output.rstrip(os.sep) + '.checkpoint'
+    args.root = os.path.abspath(args.source if os.path.isdir(args.source)
+                                else os.path.dirname(args.source))
+
+    done, position, valid = load_checkpoint(checkpoint_path)
+    if os.path.exists(checkpoint_path):
+        # Drop a record cut short by a crash so new ones start on a fresh line.
+        os.truncate(checkpoint_path, valid)
+    todo = [p for p in find_images(args.source) if p not in done]
+    print(f"→ {len(todo)} images to process ({len(done)} already done per '{checkpoint_path}')")
+    writer = DetectionWriter(args.output, fmt, position)
+    if not todo:
+        writer.close()
+        return 0
+
+    # Workers inherit this; each has its own ONNX session, so split the cores.
+    os.environ.setdefault('ORT_INTRA_OP_THREADS', str(max(1, (os.cpu_count() or 1) // args.workers)))
+    chunks = [todo[i:i + args.chunk_size] for i in range(0, len(todo), args.chunk_size)]
+    processed = 0
+    started = time.monotonic()
+    # Spawn rather than fork: onnxruntime thread pools don't survive a fork.
+    context = multiprocessing.get_context('spawn')
+    try:
+        startup_lock = context.Lock()
+        with context.Pool(args.workers, initializer=init_worker, initargs=(args, startup_lock)) as pool, \
+                open(checkpoint_path, 'a') as checkpoint:
+            for rows, paths in pool.imap_unordered(process_chunk, chunks):
+                # Rows are synced before the checkpoint records them, and the
+                # next run cuts the output back to the last recorded position,
+                # so a crash at any point neither loses nor repeats a chunk.
+                writer.write(rows)
+                checkpoint.write(json.dumps({'paths': paths, 'position': writer.position()}) + '\n')
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                processed += len(paths)
+                rate = processed / (time.monotonic() - started)
+                print(f'  {processed}/{len(todo)} images ({rate:.1f}/s)', flush=True)
+    except KeyboardInterrupt:
+        print('✖ Interrupted; re-run the same command to resume.')
+        return 130
+    finally:
+        writer.close()
+    print(f"✔ Done. Detections written to '{args.output}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
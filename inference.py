@@ -0,0 +1,368 @@
+# Inference core shared by the Flask (app.py) and ASGI (asgi_app.py) services:
+# model download and loading, upload validation, admission control and detection.
+import os
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# ─── Upload Limits ────────────────────────────────────────────────────────────
+# Largest accepted request body, in megabytes:
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', 10))
+# Largest accepted image, in pixels (width * height), to stop decompression bombs:
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+# OpenCV reads its own decode cap from the environment, so set it before import:
+os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(MAX_IMAGE_PIXELS))
+
+import cv2
+import gdown
+import numpy as np
+import onnxruntime
+from PIL import Image
+from ultralytics import YOLO
+
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# ─── New: Google Drive Download Logic ────────────────────────────────────────
+# 1) RAW Drive file ID:
+DRIVE_FILE_ID = '1B0FfStSYKtdQ8Hh9UfyXWMHLzvbcid41'
+# 2) Construct the “export=download” URL for gdown:
+DRIVE_URL = f'https://drive.google.com/uc?export=download&id={DRIVE_FILE_ID}'
+# 3) Local filename we want:
+LOCAL_MODEL_PATH = 'best.onnx'
+
+# If the ONNX model isn't already on disk, download it from Drive:
+if not os.path.exists(LOCAL_MODEL_PATH):
+    print(f"→ Downloading ONNX model from Google Drive to '{LOCAL_MODEL_PATH}' …")
+    # gdown will handle large-file tokens automatically.
+    gdown.download(DRIVE_URL, LOCAL_MODEL_PATH, quiet=False)
+    print("✔ Download complete.")
+
+# ─── End of Download Logic ────────────────────────────────────────────────────
+
+# Configuration
+UPLOAD_FOLDER = 'uploads'
+RESULT_FOLDER = 'static/results'
+MODEL_PATH = LOCAL_MODEL_PATH    # now points to the downloaded file
+
+# Load the YOLO ONNX model using Ultralytics
+model = YOLO(MODEL_PATH)
+
+# Leading bytes of the image formats the model can read.
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+    (b'RIFF', 'WEBP'),
+]
+
+
+class InvalidUpload(Exception):
+    """Raised when an upload is not an image we are willing to decode; carries the HTTP status."""
+
+    def __init__(self, message, status=415):
+        super().__init__(message)
+        self.status = status
+
+
+def validate_image(stream):
+    """Check an upload's magic bytes and header dimensions without decoding it."""
+    head = stream.read(16)
+    stream.seek(0)
+    if not any(head.startswith(sig) for sig, _ in IMAGE_SIGNATURES):
+        raise InvalidUpload('Unsupported file type, please upload a JPG, PNG, BMP, TIFF or WEBP image')
+    if head.startswith(b'RIFF') and head[8:12] != b'WEBP':
+        raise InvalidUpload('Unsupported file type, please upload a JPG, PNG, BMP, TIFF or WEBP image')
+    try:
+        # Image.open only parses the header; pixel data is never touched here.
+        with Image.open(stream) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise InvalidUpload('Image dimensions are too large', 413)
+    except Exception:
+        raise InvalidUpload('Could not read image header')
+    finally:
+        stream.seek(0)
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidUpload('Image dimensions are too large', 413)
+
+# ─── Admission Control ───────────────────────────────────────────────────────
+# How many model.predict calls may run at once. Ultralytics' predictor runs
+# one call at a time under its own lock, so more slots only add threads parked
+# on that lock; each call already uses every core through ONNX Runtime.
+MAX_CONCURRENT_INFERENCE = int(os.environ.get('MAX_CONCURRENT_INFERENCE', 1))
+# How many requests may wait for a free slot before new ones are shed:
+MAX_INFERENCE_QUEUE = int(os.environ.get('MAX_INFERENCE_QUEUE', 8))
+# Longest a queued request may wait (seconds); should stay below client timeouts:
+INFERENCE_QUEUE_TIMEOUT = float(os.environ.get('INFERENCE_QUEUE_TIMEOUT', 20))
+# Uploads allowed per client per minute (0 disables the limit):
+RATE_LIMIT_PER_MINUTE = int(os.environ.get('RATE_LIMIT_PER_MINUTE', 30))
+
+inference_slots = threading.BoundedSemaphore(MAX_CONCURRENT_INFERENCE)
+admission_lock = threading.Lock()
+admission_stats = {'accepted': 0, 'queued': 0, 'shed': 0, 'rate_limited': 0,
+                   'in_flight': 0, 'waiting': 0}
+# Moving average of inference time, used to guess how long the queue will take.
+avg_inference_seconds = 1.0
+# Per-client token buckets: client -> (tokens, last refill timestamp), kept in
+# least-recently-seen order so idle clients can be evicted from the front.
+client_buckets = OrderedDict()
+
+
+class InferenceShed(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint."""
+
+    def __init__(self, status, retry_after):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def check_rate_limit(client):
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return
+    rate = RATE_LIMIT_PER_MINUTE / 60.0
+    now = time.monotonic()
+    with admission_lock:
+        # A bucket idle for a minute has refilled completely, so dropping it
+        # loses nothing; the oldest entries are at the front.
+        while client_buckets:
+            oldest, (_, seen) = next(iter(client_buckets.items()))
+            if now - seen <= 60:
+                break
+            del client_buckets[oldest]
+        tokens, last = client_buckets.get(client, (RATE_LIMIT_PER_MINUTE, now))
+        tokens = min(RATE_LIMIT_PER_MINUTE, tokens + (now - last) * rate)
+        client_buckets[client] = (tokens if tokens < 1 else tokens - 1, now)
+        client_buckets.move_to_end(client)
+        if tokens < 1:
+            admission_stats['rate_limited'] += 1
+            raise InferenceShed(429, (1 - tokens) / rate)
+
+
+def admission_snapshot():
+    with admission_lock:
+        return dict(admission_stats)
+
+
+def admit():
+    """Reserve a place for one inference without blocking, or raise InferenceShed.
+
+    Returns the deadline (time.monotonic()) by which the request must get a
+    slot; pass it to inference_slot, which releases the reservation.
+    """
+    with admission_lock:
+        # How far past the free slots this request would land in the queue.
+        ahead = (admission_stats['in_flight'] + admission_stats['waiting']
+                 - MAX_CONCURRENT_INFERENCE + 1)
+        if ahead > 0:
+            # Shed straight away if the queue is full or the expected wait
+            # would already blow the deadline.
+            expected_wait = ahead * avg_inference_seconds / MAX_CONCURRENT_INFERENCE
+            if ahead > MAX_INFERENCE_QUEUE or expected_wait > INFERENCE_QUEUE_TIMEOUT:
+                admission_stats['shed'] += 1
+                raise InferenceShed(503, expected_wait)
+            admission_stats['queued'] += 1
+        admission_stats['waiting'] += 1
+    return time.monotonic() + INFERENCE_QUEUE_TIMEOUT
+
+
+@contextmanager
+def inference_slot(deadline=None):
+    global avg_inference_seconds
+    if deadline is None:
+        deadline = admit()
+    acquired = inference_slots.acquire(timeout=max(0, deadline - time.monotonic()))
+    with admission_lock:
+        admission_stats['waiting'] -= 1
+        if not acquired:
+            admission_stats['shed'] += 1
+            raise InferenceShed(503, avg_inference_seconds)
+        admission_stats['accepted'] += 1
+        admission_stats['in_flight'] += 1
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        with admission_lock:
+            admission_stats['in_flight'] -= 1
+            avg_inference_seconds = 0.8 * avg_inference_seconds + 0.2 * elapsed
+        inference_slots.release()
+
+# ─── End of Admission Control ─────────────────────────────────────────────────
+
+# ─── ONNX Runtime Session ─────────────────────────────────────────────────────
+# Ultralytics creates its onnxruntime session with default options and gives us
+# no hook for them, so while it builds its backend we hand it a session built
+# from these settings instead.
+# Threads per inference (0 lets ONNX Runtime use every physical core):
+ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))
+ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 1))
+# 'sequential' or 'parallel'
+ORT_EXECUTION_MODE = os.environ.get('ORT_EXECUTION_MODE', 'sequential')
+# 'disable', 'basic', 'extended' or 'all'
+ORT_GRAPH_OPT_LEVEL = os.environ.get('ORT_GRAPH_OPT_LEVEL', 'all')
+ORT_ENABLE_CPU_MEM_ARENA = os.environ.get('ORT_ENABLE_CPU_MEM_ARENA', '1') == '1'
+ORT_ENABLE_MEM_PATTERN = os.environ.get('ORT_ENABLE_MEM_PATTERN', '1') == '1'
+# Where to keep the optimised graph. It is written on the first start and loaded
+# on later ones, skipping optimisation. Only used with the plain CPU provider:
+# compiling providers (OpenVINO, oneDNN) can't serialise their graphs. A stamp
+# file next to it records the source model, optimisation level and ONNX Runtime
+# version, and the graph is rebuilt when any of them change. At the
+# 'extended'/'all' levels the saved graph is also tied to the machine it was
+# built on, so delete it after moving to different hardware.
+ORT_OPTIMIZED_MODEL_PATH = os.environ.get('ORT_OPTIMIZED_MODEL_PATH', '')
+# Comma-separated provider names; by default the first installed provider from
+# PREFERRED_PROVIDERS is used, falling back to the CPU provider.
+ORT_PROVIDERS = os.environ.get('ORT_PROVIDERS', '')
+PREFERRED_PROVIDERS = ['OpenVINOExecutionProvider', 'DnnlExecutionProvider', 'CPUExecutionProvider']
+
+GRAPH_OPT_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+if ORT_GRAPH_OPT_LEVEL not in GRAPH_OPT_LEVELS:
+    raise ValueError(f"ORT_GRAPH_OPT_LEVEL must be one of {', '.join(GRAPH_OPT_LEVELS)}, "
+                     f"not {ORT_GRAPH_OPT_LEVEL!r}")
+if ORT_EXECUTION_MODE not in EXECUTION_MODES:
+    raise ValueError(f"ORT_EXECUTION_MODE must be one of {', '.join(EXECUTION_MODES)}, "
+                     f"not {ORT_EXECUTION_MODE!r}")
+
+# Kept so build_onnx_session still reaches the real class while configure_model
+# has onnxruntime.InferenceSession pointed at it.
+OrtInferenceSession = onnxruntime.InferenceSession
+
+
+def select_providers():
+    available = onnxruntime.get_available_providers()
+    if ORT_PROVIDERS:
+        requested = [p.strip() for p in ORT_PROVIDERS.split(',') if p.strip()]
+        missing = [p for p in requested if p not in available]
+        if missing:
+            print(f"⚠ Ignoring unavailable ONNX Runtime providers: {', '.join(missing)}")
+        providers = [p for p in requested if p in available]
+    else:
+        providers = [p for p in PREFERRED_PROVIDERS if p in available][:1]
+    if 'CPUExecutionProvider' not in providers:
+        providers.append('CPUExecutionProvider')
+    return providers
+
+
+def optimized_model_stamp(model_path):
+    source = os.stat(model_path)
+    return {'source': os.path.abspath(model_path), 'size': source.st_size,
+            'mtime_ns': source.st_mtime_ns, 'graph_opt': ORT_GRAPH_OPT_LEVEL,
+            'onnxruntime': onnxruntime.__version__}
+
+
+def build_onnx_session(model_path, *args, **kwargs):
+    # Takes (and ignores) Ultralytics' own session arguments so it can stand in
+    # for onnxruntime.InferenceSession; only the model path is kept.
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.execution_mode = EXECUTION_MODES[ORT_EXECUTION_MODE]
+    options.enable_cpu_mem_arena = ORT_ENABLE_CPU_MEM_ARENA
+    options.enable_mem_pattern = ORT_ENABLE_MEM_PATTERN
+    options.graph_optimization_level = GRAPH_OPT_LEVELS[ORT_GRAPH_OPT_LEVEL]
+    providers = select_providers()
+    if ORT_OPTIMIZED_MODEL_PATH and providers != ['CPUExecutionProvider']:
+        print(f"⚠ Not using ORT_OPTIMIZED_MODEL_PATH: {providers[0]} compiles the graph, "
+              f"which ONNX Runtime can't serialise")
+    elif ORT_OPTIMIZED_MODEL_PATH:
+        stamp_path = ORT_OPTIMIZED_MODEL_PATH + '.json'
+        stamp = optimized_model_stamp(model_path)
+        try:
+            with open(stamp_path) as f:
+                cached_stamp = json.load(f)
+        except (OSError, ValueError):
+            cached_stamp = None
+        if os.path.exists(ORT_OPTIMIZED_MODEL_PATH) and cached_stamp == stamp:
+            # Already optimised on a previous start, so load it as-is.
+            model_path = ORT_OPTIMIZED_MODEL_PATH
+            options.graph_optimization_level = GRAPH_OPT_LEVELS['disable']
+        else:
+            if os.path.exists(ORT_OPTIMIZED_MODEL_PATH):
+                print(f"→ Rebuilding '{ORT_OPTIMIZED_MODEL_PATH}': the model or its settings changed")
+            # Drop the old stamp first, so a crash mid-write can't leave a
+            # matching stamp next to a half-written graph.
+            if os.path.exists(stamp_path):
+                os.remove(stamp_path)
+            options.optimized_model_filepath = ORT_OPTIMIZED_MODEL_PATH
+            session = create_session(model_path, options, providers)
+            with open(stamp_path, 'w') as f:
+                json.dump(stamp, f)
+            return session
+    return create_session(model_path, options, providers)
+
+
+def create_session(model_path, options, providers):
+    print(f"→ ONNX Runtime session: providers={providers}, "
+          f"intra_op_threads={ORT_INTRA_OP_THREADS or 'auto'}, graph_opt={ORT_GRAPH_OPT_LEVEL}")
+    return OrtInferenceSession(str(model_path), sess_options=options, providers=providers)
+
+
+def configure_model(yolo_model):
+    # Ultralytics builds its backend (session, IO bindings, batch shape) on the
+    # first predict. Run a blank image through while onnxruntime.InferenceSession
+    # points at build_onnx_session, so the backend is built on our session from
+    # the start and the default one is never created.
+    onnxruntime.InferenceSession = build_onnx_session
+    try:
+        yolo_model.predict(source=np.zeros((640, 640, 3), dtype=np.uint8), imgsz=640, verbose=False)
+    finally:
+        onnxruntime.InferenceSession = OrtInferenceSession
+
+configure_model(model)
+
+# ─── End of ONNX Runtime Session ──────────────────────────────────────────────
+
+
+def predict(source, **kwargs):
+    """Run the model on an image path or array, or a list of them."""
+    return model.predict(source=source, imgsz=640, **kwargs)
+
+
+def batch_limit():
+    """Fixed batch size of the loaded ONNX graph, or None if the batch axis is dynamic."""
+    backend = getattr(model.predictor, 'model', None)
+    session = getattr(backend, 'session', None)
+    if session is None:
+        return None
+    batch = session.get_inputs()[0].shape[0]
+    return batch if isinstance(batch, int) else None
+
+
+def run_detection(upload_path, output_path, deadline=None):
+    """Detect tumors in the image at upload_path and write the annotated copy to output_path.
+
+    Waits for a free inference slot first and raises InferenceShed if none
+    becomes available in time. Pass the deadline from admit() if the request
+    was already admitted.
+    """
+    with inference_slot(deadline):
+        results = predict(upload_path)
+
+        # Force manual saving of the result image:
+        # Get the plotted result as a numpy array
+        img_result = results[0].plot()
+        cv2.imwrite(output_path, img_result)
+
+
+def create_folders():
+    for folder in [UPLOAD_FOLDER, RESULT_FOLDER]:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+create_folders()
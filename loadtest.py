@@ -0,0 +1,140 @@
+"""Compare the Flask (app.py) and ASGI (asgi_app.py) services under load.
+
+Start both servers first, with the per-client rate limit off since every
+request comes from this machine, e.g.
+
+    export RATE_LIMIT_PER_MINUTE=0
+    gunicorn -w 1 --threads 8 -b 127.0.0.1:5000 app:app
+    uvicorn asgi_app:app --host 127.0.0.1 --port 8000
+
+then run
+
+    python loadtest.py --image scan.jpg \\
+        --target flask=http://127.0.0.1:5000 --target asgi=http://127.0.0.1:8000
+
+Each target gets a number of slow clients that drip an upload a few bytes at a
+time, plus a batch of normal uploads whose latency and status codes are reported.
+A server that ties a thread to each connection stalls behind the slow clients;
+one that receives uploads asynchronously keeps serving the normal ones.
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+def multipart_body(image_path):
+    boundary = uuid.uuid4().hex
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    filename = os.path.basename(image_path)
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return boundary, body
+
+
+def request_head(url, boundary, length):
+    parts = urlsplit(url)
+    return (
+        f'POST {parts.path or "/"} HTTP/1.1\r\n'
+        f'Host: {parts.netloc}\r\n'
+        f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+        f'Content-Length: {length}\r\n'
+        f'Connection: close\r\n\r\n'
+    ).encode()
+
+
+async def post(url, boundary, body, chunk_size=None, delay=0.0, timeout=60.0):
+    """Send one upload and return its HTTP status (or an error name)."""
+    parts = urlsplit(url)
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+    except (OSError, asyncio.TimeoutError) as err:
+        return type(err).__name__
+    try:
+        writer.write(request_head(url, boundary, len(body)))
+        if chunk_size:
+            for i in range(0, len(body), chunk_size):
+                writer.write(body[i:i + chunk_size])
+                await writer.drain()
+                await asyncio.sleep(delay)
+        else:
+            writer.write(body)
+            await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await reader.read()
+        fields = status_line.split()
+        return int(fields[1]) if len(fields) > 1 else 'EmptyResponse'
+    except (OSError, asyncio.TimeoutError) as err:
+        return type(err).__name__
+    finally:
+        writer.close()
+
+
+async def run_target(url, boundary, body, args):
+    slow = [asyncio.create_task(post(url, boundary, body, chunk_size=args.slow_chunk,
+                                     delay=args.slow_delay, timeout=args.timeout))
+            for _ in range(args.slow)]
+    # Give the slow clients time to occupy their connections.
+    await asyncio.sleep(1.0)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def timed():
+        async with semaphore:
+            started = time.perf_counter()
+            status = await post(url, boundary, body, timeout=args.timeout)
+            latencies.append(time.perf_counter() - started)
+            return status
+
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*(timed() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    for task in slow:
+        task.cancel()
+    await asyncio.gather(*slow, return_exceptions=True)
+    return statuses, latencies, elapsed
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--image', required=True, help='image file to upload')
+    parser.add_argument('--target', action='append', required=True,
+                        help='name=url of a server to test; may be repeated')
+    parser.add_argument('--requests', type=int, default=50, help='normal uploads per target')
+    parser.add_argument('--concurrency', type=int, default=10, help='normal uploads in flight at once')
+    parser.add_argument('--slow', type=int, default=200, help='slow-upload connections per target')
+    parser.add_argument('--slow-chunk', type=int, default=64, help='bytes sent per slow write')
+    parser.add_argument('--slow-delay', type=float, default=0.5, help='seconds between slow writes')
+    parser.add_argument('--timeout', type=float, default=60.0, help='per-request timeout in seconds')
+    args = parser.parse_args()
+
+    boundary, body = multipart_body(args.image)
+    print(f"{'target':<10} {'ok':>5} {'rps':>7} {'p50':>7} {'p95':>7} {'max':>7}  statuses")
+    for target in args.target:
+        name, url = target.split('=', 1)
+        statuses, latencies, elapsed = await run_target(url, boundary, body, args)
+        counts = Counter(statuses)
+        ok = sum(n for status, n in counts.items() if status in (200, 302))
+        print(f'{name:<10} {ok:>5} {len(statuses) / elapsed:>7.2f} '
+              f'{percentile(latencies, 50):>7.2f} {percentile(latencies, 95):>7.2f} '
+              f'{max(latencies, default=float("nan")):>7.2f}  {dict(counts)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())